@@ -1,16 +1,26 @@
+import atexit
 import csv
+import hashlib
+import hmac
 import io
-import json
+import operator
 import os
+import queue
 import sqlite3
-from datetime import datetime
+import time
 from functools import wraps
+from threading import Lock
 
+import orjson
 import requests
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 from flask import (
     Flask,
     Response,
+    abort,
     flash,
     g,
     jsonify,
@@ -20,25 +30,122 @@ from flask import (
     session,
     url_for,
 )
+from flask.json.provider import DefaultJSONProvider
 
 load_dotenv()
 
+
+# orjson-backed JSON provider; types orjson can't handle natively still go
+# through Flask's default serializer.
+class OrjsonProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(
+            obj, default=self.default, option=orjson.OPT_NON_STR_KEYS
+        ).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "dev-secret-change-me")
 
 DATABASE = os.environ.get("DATABASE_PATH", "/app/data/registrations.db")
 ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD", "changeme")
+ASSETS_DIR = os.environ.get("ASSETS_DIR", "/app/assets")
+# One connection per gunicorn thread, so a long CSV export can't starve the
+# other DB routes; DB_POOL_SIZE can still override it.
+DB_POOL_SIZE = int(
+    os.environ.get("DB_POOL_SIZE") or os.environ.get("GUNICORN_THREADS", "8")
+)
+DB_POOL_TIMEOUT = 10
+EXPORT_CHUNK_SIZE = 500
+DASHBOARD_PAGE_SIZE = 50
+
+
+# Hash of everything in site/assets (mounted at ASSETS_DIR), appended to
+# /assets/ URLs as ?v= so nginx can cache them for a year and any edit to an
+# asset changes the URL. ASSET_VERSION overrides it; with neither, URLs go
+# out unversioned and get nginx's 30-day policy.
+def _asset_version():
+    digest = hashlib.sha256()
+    try:
+        names = sorted(os.listdir(ASSETS_DIR))
+    except OSError:
+        return ""
+    for name in names:
+        path = os.path.join(ASSETS_DIR, name)
+        if os.path.isfile(path):
+            digest.update(name.encode())
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+ASSET_VERSION = os.environ.get("ASSET_VERSION") or _asset_version()
+
+
+@app.context_processor
+def inject_asset_version():
+    return {"asset_version": ASSET_VERSION}
 
 
 # ---------------------------------------------------------------------------
 # Database helpers
 # ---------------------------------------------------------------------------
 
+# SQLite's lower()/LIKE only fold ASCII; this gives the dashboard search the
+# same Unicode-aware lowercasing the old client-side filter had ("Érica").
+def _sql_lower(value):
+    return value.lower() if isinstance(value, str) else value
+
+
+def _connect():
+    os.makedirs(os.path.dirname(DATABASE), exist_ok=True)
+    conn = sqlite3.connect(DATABASE, check_same_thread=False, cached_statements=256)
+    conn.row_factory = sqlite3.Row
+    conn.create_function("pylower", 1, _sql_lower, deterministic=True)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-20000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+# Long-lived connections shared across requests so SQLite's page cache stays
+# warm; each request borrows one and hands it back on teardown.
+_db_pool = queue.Queue(maxsize=DB_POOL_SIZE)
+for _ in range(DB_POOL_SIZE):
+    _db_pool.put(_connect())
+
+
+@atexit.register
+def _close_db_pool():
+    while True:
+        try:
+            _db_pool.get_nowait().close()
+        except queue.Empty:
+            break
+
+
+def _acquire_db():
+    try:
+        return _db_pool.get(timeout=DB_POOL_TIMEOUT)
+    except queue.Empty:
+        abort(503)
+
+
+@app.errorhandler(503)
+def service_unavailable(e):
+    if request.path.startswith("/api/"):
+        return jsonify({"error": "Serviço indisponível, tente novamente."}), 503
+    return e
+
+
 def get_db():
     if "db" not in g:
-        os.makedirs(os.path.dirname(DATABASE), exist_ok=True)
-        g.db = sqlite3.connect(DATABASE)
-        g.db.row_factory = sqlite3.Row
+        g.db = _acquire_db()
     return g.db
 
 
@@ -46,7 +153,16 @@ def get_db():
 def close_db(exception):
     db = g.pop("db", None)
     if db is not None:
+        _release_db(db)
+
+
+def _release_db(db):
+    try:
+        db.rollback()
+    except sqlite3.Error:
         db.close()
+        db = _connect()
+    _db_pool.put(db)
 
 
 def init_db():
@@ -79,6 +195,17 @@ def init_db():
             notes TEXT
         )
     """)
+    # Matches the dashboard's ORDER BY created_at DESC, id DESC so rows sharing
+    # a timestamp (e.g. from one bulk insert) need no extra sort; it replaces
+    # the earlier created_at-only index.
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_regs_created_id_desc"
+        " ON registrations(created_at DESC, id DESC)"
+    )
+    db.execute("DROP INDEX IF EXISTS idx_regs_created_desc")
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_regs_status ON registrations(status)"
+    )
     db.commit()
 
 
@@ -87,9 +214,21 @@ with app.app_context():
 
 
 # ---------------------------------------------------------------------------
-# Admin auth decorator
+# Admin auth
 # ---------------------------------------------------------------------------
 
+_ADMIN_SALT = os.urandom(16)
+
+
+def _hash_password(password):
+    return hashlib.scrypt(password.encode(), salt=_ADMIN_SALT, n=2**14, r=8, p=1)
+
+
+# Derived once at startup; login attempts are hashed the same way and compared
+# in constant time.
+_ADMIN_HASH = _hash_password(ADMIN_PASSWORD)
+
+
 def admin_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -99,87 +238,247 @@ def admin_required(f):
     return decorated
 
 
+def admin_api_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not session.get("admin"):
+            return jsonify({"error": "Não autorizado"}), 401
+        return f(*args, **kwargs)
+    return decorated
+
+
 # ---------------------------------------------------------------------------
 # Registration routes
 # ---------------------------------------------------------------------------
 
+CADASTRO_TEMPLATE = app.jinja_env.get_template("cadastro.html")
+
+
 @app.route("/cadastro")
 def cadastro():
-    return render_template("cadastro.html")
+    return render_template(CADASTRO_TEMPLATE)
 
 
-@app.route("/api/registrations", methods=["POST"])
-def create_registration():
-    data = request.get_json()
-    if not data:
-        return jsonify({"error": "Dados inválidos"}), 400
+INSERT_SQL = """INSERT INTO registrations
+   (nome, email, telefone, cnpj, razao_social, nome_fantasia,
+    cep, endereco, numero, complemento, bairro, cidade, uf,
+    site, instagram, num_funcionarios, empresas_brinde,
+    segmento, como_conheceu, termos_aceitos)
+   VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)"""
+
+
+# Free-text columns in INSERT_SQL order; empresas_brinde sits between the
+# last two and termos_aceitos closes the tuple.
+_STR_FIELDS = (
+    "nome", "email", "telefone", "cnpj", "razao_social", "nome_fantasia",
+    "cep", "endereco", "numero", "complemento", "bairro", "cidade", "uf",
+    "site", "instagram", "num_funcionarios", "segmento", "como_conheceu",
+)
+_REQUIRED_FIELDS = ("nome", "email", "telefone", "cnpj")
+
+
+def _text(value):
+    # Numbers are accepted for text columns (bulk imports often send numero,
+    # cep or num_funcionarios as numbers) and stored as their string form.
+    if value is None:
+        return ""
+    return str(value).strip()
+
 
-    required = ["nome", "email", "telefone", "cnpj"]
-    for field in required:
-        if not data.get(field, "").strip():
-            return jsonify({"error": f"Campo obrigatório: {field}"}), 400
+def _field_error(data):
+    for field in _STR_FIELDS:
+        value = data.get(field)
+        if value is not None and (
+            isinstance(value, bool) or not isinstance(value, (str, int, float))
+        ):
+            return f"Campo inválido: {field}"
+    empresas = data.get("empresas_brinde")
+    if empresas is not None and not isinstance(empresas, (list, str)):
+        return "Campo inválido: empresas_brinde"
+    for field in _REQUIRED_FIELDS:
+        if not _text(data.get(field)):
+            return f"Campo obrigatório: {field}"
+    return None
+
+
+def _registration_params(data):
+    clean = {k: _text(data.get(k)) for k in _STR_FIELDS}
+    clean["email"] = clean["email"].lower()
 
     empresas = data.get("empresas_brinde", [])
     if isinstance(empresas, list):
-        empresas = json.dumps(empresas)
+        empresas = orjson.dumps(empresas).decode()
+
+    return (
+        *(clean[k] for k in _STR_FIELDS[:-2]),
+        empresas,
+        clean["segmento"],
+        clean["como_conheceu"],
+        1 if data.get("termos_aceitos") else 0,
+    )
+
+
+# Returns (data, None) for a JSON body of the expected type, or
+# (None, error_response) otherwise.
+def _json_body(expected_type):
+    # Only requests sent as JSON are parsed. A text/plain body can be posted
+    # cross-site by a plain HTML form, so accepting it would let another site
+    # reach these endpoints with the visitor's session cookie.
+    if not request.is_json:
+        return None, (
+            jsonify({"error": "Envie os dados como application/json"}),
+            415,
+        )
+    try:
+        data = orjson.loads(request.get_data(cache=False))
+    except orjson.JSONDecodeError:
+        data = None
+    if not data or not isinstance(data, expected_type):
+        return None, (jsonify({"error": "Dados inválidos"}), 400)
+    return data, None
+
+
+@app.route("/api/registrations", methods=["POST"])
+def create_registration():
+    data, bad_request = _json_body(dict)
+    if bad_request:
+        return bad_request
+
+    error = _field_error(data)
+    if error:
+        return jsonify({"error": error}), 400
 
     db = get_db()
     try:
-        db.execute(
-            """INSERT INTO registrations
-               (nome, email, telefone, cnpj, razao_social, nome_fantasia,
-                cep, endereco, numero, complemento, bairro, cidade, uf,
-                site, instagram, num_funcionarios, empresas_brinde,
-                segmento, como_conheceu, termos_aceitos)
-               VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
-            (
-                data["nome"].strip(),
-                data["email"].strip().lower(),
-                data["telefone"].strip(),
-                data["cnpj"].strip(),
-                data.get("razao_social", "").strip(),
-                data.get("nome_fantasia", "").strip(),
-                data.get("cep", "").strip(),
-                data.get("endereco", "").strip(),
-                data.get("numero", "").strip(),
-                data.get("complemento", "").strip(),
-                data.get("bairro", "").strip(),
-                data.get("cidade", "").strip(),
-                data.get("uf", "").strip(),
-                data.get("site", "").strip(),
-                data.get("instagram", "").strip(),
-                data.get("num_funcionarios", "").strip(),
-                empresas,
-                data.get("segmento", "").strip(),
-                data.get("como_conheceu", "").strip(),
-                1 if data.get("termos_aceitos") else 0,
-            ),
-        )
-        db.commit()
+        with db:
+            db.execute(INSERT_SQL, _registration_params(data))
     except sqlite3.IntegrityError:
         return jsonify({"error": "Este e-mail já está cadastrado."}), 409
 
     return jsonify({"ok": True}), 201
 
 
+@app.route("/api/registrations/bulk", methods=["POST"])
+@admin_api_required
+def create_registrations_bulk():
+    data, bad_request = _json_body(list)
+    if bad_request:
+        return bad_request
+
+    for i, item in enumerate(data):
+        if not isinstance(item, dict):
+            return jsonify({"error": f"Registro {i}: dados inválidos"}), 400
+        error = _field_error(item)
+        if error:
+            return jsonify({"error": f"Registro {i}: {error}"}), 400
+
+    db = get_db()
+    try:
+        # Single transaction, so the whole batch costs one commit.
+        with db:
+            db.executemany(INSERT_SQL, [_registration_params(d) for d in data])
+    except sqlite3.IntegrityError:
+        return jsonify({"error": "Um ou mais e-mails já estão cadastrados."}), 409
+
+    return jsonify({"ok": True, "count": len(data)}), 201
+
+
 # ---------------------------------------------------------------------------
 # CNPJ proxy (avoids CORS issues with cnpj.ws)
 # ---------------------------------------------------------------------------
 
+# Shared session so upstream TLS connections are kept alive and reused.
+_SESSION = requests.Session()
+_SESSION.headers.update({"Accept": "application/json"})
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=64,
+        # Only connection failures and fast 5xx answers are retried; a read
+        # timeout already cost the full 10 s and Retry-After could sleep for
+        # minutes, either of which would pin a worker thread.
+        max_retries=Retry(
+            total=2,
+            connect=2,
+            read=0,
+            backoff_factor=0.1,
+            status_forcelist=[502, 503, 504],
+            respect_retry_after_header=False,
+        ),
+    ),
+)
+
+_CNPJ_STRIP = str.maketrans("", "", "./-")
+_CEP_STRIP = str.maketrans("", "", "-.")
+
+_CNPJ_WEIGHTS_1 = (5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2)
+_CNPJ_WEIGHTS_2 = (6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2)
+
+
+# Maps ASCII digits to their values so the weighted sums run in C via map().
+_ASCII_DIGIT_VALUES = bytes.maketrans(b"0123456789", bytes(range(10)))
+
+
+def _cnpj_check_digit(digits, weights):
+    r = sum(map(operator.mul, digits, weights)) % 11
+    return 0 if r < 2 else 11 - r
+
+
+# Checks both mod-11 check digits of a 14-digit ASCII CNPJ (as bytes).
+def _valid_cnpj(c):
+    if c == c[:1] * 14:
+        return False
+    d = c.translate(_ASCII_DIGIT_VALUES)
+    return (
+        _cnpj_check_digit(d, _CNPJ_WEIGHTS_1) == d[12]
+        and _cnpj_check_digit(d, _CNPJ_WEIGHTS_2) == d[13]
+    )
+
+
+# Upstream lookup results change rarely; keep the raw response bodies so
+# repeat autofill hits never leave the process.
+_cnpj_cache = TTLCache(maxsize=10_000, ttl=86_400)
+_cep_cache = TTLCache(maxsize=50_000, ttl=604_800)
+_lookup_cache_lock = Lock()
+
+
+def _cache_get(cache, key):
+    with _lookup_cache_lock:
+        return cache.get(key)
+
+
+def _cache_set(cache, key, body):
+    with _lookup_cache_lock:
+        cache[key] = body
+
+
+def _lookup_response(body):
+    resp = Response(body, mimetype="application/json")
+    resp.headers["Cache-Control"] = "public, max-age=86400"
+    return resp
+
+
 @app.route("/api/cnpj/<cnpj>")
 def cnpj_lookup(cnpj):
-    cnpj = cnpj.replace(".", "").replace("/", "").replace("-", "")
-    if len(cnpj) != 14 or not cnpj.isdigit():
+    cnpj = cnpj.translate(_CNPJ_STRIP)
+    if (
+        len(cnpj) != 14
+        or not cnpj.isascii()
+        or not cnpj.isdigit()
+        or not _valid_cnpj(cnpj.encode())
+    ):
         return jsonify({"error": "CNPJ inválido"}), 400
 
+    cached = _cache_get(_cnpj_cache, cnpj)
+    if cached is not None:
+        return _lookup_response(cached)
+
     try:
-        resp = requests.get(
-            f"https://publica.cnpj.ws/cnpj/{cnpj}",
-            timeout=10,
-            headers={"Accept": "application/json"},
-        )
+        resp = _SESSION.get(f"https://publica.cnpj.ws/cnpj/{cnpj}", timeout=10)
         if resp.status_code == 200:
-            return jsonify(resp.json())
+            _cache_set(_cnpj_cache, cnpj, resp.content)
+            return _lookup_response(resp.content)
         return jsonify({"error": "CNPJ não encontrado"}), resp.status_code
     except requests.RequestException:
         return jsonify({"error": "Erro ao consultar CNPJ"}), 502
@@ -189,16 +488,33 @@ def cnpj_lookup(cnpj):
 # CEP proxy (viacep.com.br)
 # ---------------------------------------------------------------------------
 
+# ViaCEP answers unknown CEPs with 200 and {"erro": true}; those must not be
+# cached as if they were successful lookups.
+def _viacep_found(body):
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        return False
+    return isinstance(data, dict) and not data.get("erro")
+
+
 @app.route("/api/cep/<cep>")
 def cep_lookup(cep):
-    cep = cep.replace("-", "").replace(".", "")
+    cep = cep.translate(_CEP_STRIP)
     if len(cep) != 8 or not cep.isdigit():
         return jsonify({"error": "CEP inválido"}), 400
 
+    cached = _cache_get(_cep_cache, cep)
+    if cached is not None:
+        return _lookup_response(cached)
+
     try:
-        resp = requests.get(f"https://viacep.com.br/ws/{cep}/json/", timeout=10)
+        resp = _SESSION.get(f"https://viacep.com.br/ws/{cep}/json/", timeout=10)
         if resp.status_code == 200:
-            return jsonify(resp.json())
+            if not _viacep_found(resp.content):
+                return Response(resp.content, mimetype="application/json")
+            _cache_set(_cep_cache, cep, resp.content)
+            return _lookup_response(resp.content)
         return jsonify({"error": "CEP não encontrado"}), resp.status_code
     except requests.RequestException:
         return jsonify({"error": "Erro ao consultar CEP"}), 502
@@ -208,17 +524,56 @@ def cep_lookup(cep):
 # Admin routes
 # ---------------------------------------------------------------------------
 
+_DASHBOARD_SELECT = """SELECT id, nome, email, telefone, cnpj, razao_social,
+       nome_fantasia, cep, endereco, numero, complemento, bairro, cidade, uf,
+       site, instagram, num_funcionarios, empresas_brinde, segmento,
+       como_conheceu, status, created_at, notes
+FROM registrations"""
+_DASHBOARD_ORDER = " ORDER BY created_at DESC, id DESC LIMIT ?"
+_DASHBOARD_SEARCH = (
+    "pylower(nome || ' ' || email || ' ' || cnpj || ' '"
+    " || COALESCE(nome_fantasia, '') || ' ' || COALESCE(razao_social, ''))"
+    " LIKE ? ESCAPE '\\'"
+)
+_DASHBOARD_AFTER = (
+    "(created_at, id) < (SELECT created_at, id FROM registrations WHERE id = ?)"
+)
+
+
+def _dashboard_sql(*conditions):
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    return _DASHBOARD_SELECT + where + _DASHBOARD_ORDER
+
+
+# Keyed by (searching, paging); each variant is a fixed string so it stays in
+# sqlite3's statement cache. Parameters go search, after, limit.
+DASHBOARD_SQL = {
+    (False, False): _dashboard_sql(),
+    (False, True): _dashboard_sql(_DASHBOARD_AFTER),
+    (True, False): _dashboard_sql(_DASHBOARD_SEARCH),
+    (True, True): _dashboard_sql(_DASHBOARD_SEARCH, _DASHBOARD_AFTER),
+}
+COUNT_BY_STATUS_SQL = "SELECT status, COUNT(*) FROM registrations GROUP BY status"
+UPDATE_STATUS_SQL = "UPDATE registrations SET status = ? WHERE id = ?"
+UPDATE_NOTES_SQL = "UPDATE registrations SET notes = ? WHERE id = ?"
+EXPORT_SQL = "SELECT * FROM registrations ORDER BY created_at DESC"
+
+# Resolved once at startup; render_template still applies context processors.
+ADMIN_LOGIN_TEMPLATE = app.jinja_env.get_template("admin_login.html")
+ADMIN_DASHBOARD_TEMPLATE = app.jinja_env.get_template("admin_dashboard.html")
+
+
 @app.route("/admin")
 def admin_login():
     if session.get("admin"):
         return redirect(url_for("admin_dashboard"))
-    return render_template("admin_login.html")
+    return render_template(ADMIN_LOGIN_TEMPLATE)
 
 
 @app.route("/admin/login", methods=["POST"])
 def admin_login_post():
     password = request.form.get("password", "")
-    if password == ADMIN_PASSWORD:
+    if hmac.compare_digest(_hash_password(password), _ADMIN_HASH):
         session["admin"] = True
         return redirect(url_for("admin_dashboard"))
     flash("Senha incorreta.")
@@ -234,11 +589,48 @@ def admin_logout():
 @app.route("/admin/dashboard")
 @admin_required
 def admin_dashboard():
+    # Keyset pagination: `after` is the id of the last row on the previous
+    # page, so each page is an index range scan rather than an OFFSET skip.
+    after = request.args.get("after", type=int)
+    q = request.args.get("q", "").strip()
+    params = []
+    if q:
+        escaped = q.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        params.append(f"%{escaped}%")
+    if after is not None:
+        params.append(after)
+    params.append(DASHBOARD_PAGE_SIZE + 1)
+
     db = get_db()
     registrations = db.execute(
-        "SELECT * FROM registrations ORDER BY created_at DESC"
+        DASHBOARD_SQL[bool(q), after is not None], params
     ).fetchall()
-    return render_template("admin_dashboard.html", registrations=registrations)
+
+    has_next = len(registrations) > DASHBOARD_PAGE_SIZE
+    registrations = registrations[:DASHBOARD_PAGE_SIZE]
+
+    counts = dict(db.execute(COUNT_BY_STATUS_SQL).fetchall())
+    return render_template(
+        ADMIN_DASHBOARD_TEMPLATE,
+        registrations=registrations,
+        counts=counts,
+        total=sum(counts.values()),
+        q=q,
+        after=after,
+        is_first_page=after is None,
+        next_after=registrations[-1]["id"] if has_next else None,
+    )
+
+
+def _redirect_to_dashboard():
+    # Return to the page and search the action was submitted from.
+    return redirect(
+        url_for(
+            "admin_dashboard",
+            after=request.form.get("after", type=int),
+            q=request.form.get("q") or None,
+        )
+    )
 
 
 @app.route("/admin/registrations/<int:reg_id>/status", methods=["POST"])
@@ -249,11 +641,9 @@ def update_status(reg_id):
         return jsonify({"error": "Status inválido"}), 400
 
     db = get_db()
-    db.execute(
-        "UPDATE registrations SET status = ? WHERE id = ?", (new_status, reg_id)
-    )
+    db.execute(UPDATE_STATUS_SQL, (new_status, reg_id))
     db.commit()
-    return redirect(url_for("admin_dashboard"))
+    return _redirect_to_dashboard()
 
 
 @app.route("/admin/registrations/<int:reg_id>/notes", methods=["POST"])
@@ -261,32 +651,45 @@ def update_status(reg_id):
 def update_notes(reg_id):
     notes = request.form.get("notes", "")
     db = get_db()
-    db.execute("UPDATE registrations SET notes = ? WHERE id = ?", (notes, reg_id))
+    db.execute(UPDATE_NOTES_SQL, (notes, reg_id))
     db.commit()
-    return redirect(url_for("admin_dashboard"))
+    return _redirect_to_dashboard()
 
 
 @app.route("/admin/export")
 @admin_required
 def export_csv():
-    db = get_db()
-    rows = db.execute(
-        "SELECT * FROM registrations ORDER BY created_at DESC"
-    ).fetchall()
-
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(rows[0].keys() if rows else [])
-    for row in rows:
-        writer.writerow(list(row))
-
-    return Response(
-        output.getvalue(),
+    # Borrow a connection outside of `g` so it stays checked out for the
+    # lifetime of the stream rather than the request context. It is taken
+    # before the response starts so an exhausted pool is still a clean 503.
+    db = _acquire_db()
+
+    def generate():
+        # Plain tuples: the CSV writer only iterates rows positionally.
+        cur = db.cursor()
+        cur.row_factory = None
+        cur.execute(EXPORT_SQL)
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow([d[0] for d in cur.description])
+        yield buf.getvalue()
+        while rows := cur.fetchmany(EXPORT_CHUNK_SIZE):
+            buf.seek(0)
+            buf.truncate()
+            writer.writerows(rows)
+            yield buf.getvalue()
+
+    resp = Response(
+        generate(),
         mimetype="text/csv",
         headers={
-            "Content-Disposition": f"attachment; filename=cadastros_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+            "Content-Disposition": f"attachment; filename=cadastros_{time.strftime('%Y%m%d_%H%M%S')}.csv"
         },
     )
+    # Runs once the server closes the response, even if the stream was never
+    # consumed or was cut short.
+    resp.call_on_close(lambda: _release_db(db))
+    return resp
 
 
 if __name__ == "__main__":